@@ -2,12 +2,13 @@
 import configparser
 import logging
 import os.path
+import tempfile
 from functools import wraps, partial
 
 import pytz
 import sqlalchemy.exc
 from dateutil.parser import parse as dtparse
-from datetime import date, timedelta
+from datetime import datetime, timedelta
 from sqlalchemy import engine_from_config
 from twx import botapi
 from twx.botapi.helpers.update_loop import UpdateLoop, Permission
@@ -17,36 +18,66 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
 from TGWeightLoss.models import *
+from TGWeightLoss.export import export_contest, FORMATS as EXPORT_FORMATS
+from TGWeightLoss.inline_cache import InlineAnswerCache
+from TGWeightLoss import compliance
+from TGWeightLoss.digest import DigestScheduler, DIGEST_SEND_RATE
+from TGWeightLoss.diary import get_diary_summary
+from TGWeightLoss.recorder import UpdateRecorder
+
+INLINE_CACHE_TIME = 30  # Seconds Telegram may serve an inline answer from its own cache
+
+
+def transactional(f):
+    @wraps(f)
+    def wrapper(*args, **kwds):
+        with unit_of_work():
+            return f(*args, **kwds)
+    return wrapper
 
 
 def update_metadata(f):
     @wraps(f)
     def wrapper(*args, **kwds):
-        if args[1].chat.type in ['supergroup', 'group']:
-            Chat.create_or_get(args[1].chat)
-        User.create_or_get(args[1].sender)
-        return f(*args, **kwds)
+        with unit_of_work():
+            if args[1].chat.type in ['supergroup', 'group']:
+                Chat.create_or_get(args[1].chat)
+            User.create_or_get(args[1].sender)
+            return f(*args, **kwds)
     return wrapper
 
 
 class WeightLossBot:
-    def __init__(self, config):
+    def __init__(self, config, bot=None, mfp=None, worksheet=None, update_loop_cls=UpdateLoop):
+        """
+        bot, mfp, worksheet and update_loop_cls are only overridden to wire in stubs, see TGWeightLoss.replay
+        """
         self.config = config
         self.logger = logging.Logger("WeightLossBot")
 
-        self.bot = botapi.TelegramBot(token=self.config['WeightLossBot']['bot_token'])
+        self.bot = bot or botapi.TelegramBot(token=self.config['WeightLossBot']['bot_token'])
         self.bot.update_bot_info().wait()
 
+        record_updates = self.config['WeightLossBot'].get('record_updates')
+        if record_updates:
+            UpdateRecorder(record_updates, self.config['WeightLossBot']['record_updates.salt']).install(self.bot)
+
+        self.mfp = mfp or myfitnesspal.Client(self.config['WeightLossBot']['myfitnesspal.user'], self.config['WeightLossBot']['myfitnesspal.pass'])
 
-        self.mfp = myfitnesspal.Client(self.config['WeightLossBot']['myfitnesspal.user'], self.config['WeightLossBot']['myfitnesspal.pass'])
+        if worksheet is not None:
+            self.worksheet = worksheet
+        else:
+            self.refresh_gsheet_auth()
 
-        self.refresh_gsheet_auth()
+        self.inline_cache = InlineAnswerCache()
+        self.digest_scheduler = DigestScheduler(self, rate=float(self.config['WeightLossBot'].get('digest.rate', DIGEST_SEND_RATE)))
 
-        self.update_loop = UpdateLoop(self.bot, self)
+        self.update_loop = update_loop_cls(self.bot, self)
 
         # region command registration
         # Admin Commands
         self.update_loop.register_command(name='add_contest', permission=Permission.Admin, function=self.add_contest)
+        self.update_loop.register_command(name='export_contest', permission=Permission.Admin, function=self.export_contest)
 
         # User Commands
         # self.update_loop.register_command(name='join_book', function=self.join_contest)
@@ -54,8 +85,15 @@ class WeightLossBot:
         # self.update_loop.register_command(name='get_progress', function=self.get_progress)
         # self.update_loop.register_command(name='get_deadline', function=self.get_deadline)
         self.update_loop.register_command(name='mfp_summary', function=self.get_mfp_summary)
+        self.update_loop.register_command(name='weigh_in', function=self.weigh_in)
+        self.update_loop.register_command(name='streaks', function=self.get_streaks)
+        self.update_loop.register_command(name='compliance', function=self.get_compliance)
+        self.update_loop.register_command(name='digest', permission=Permission.Admin, function=self.digest)
         # endregion
 
+    def _chat_timezone(self, chat_id):
+        return pytz.timezone(DigestSubscription.timezone_for(chat_id))
+
     def refresh_gsheet_auth(self):
         scope = ['https://spreadsheets.google.com/feeds']
         credentials = ServiceAccountCredentials.from_json_keyfile_name('gsheets_oauth.json', scope)
@@ -73,14 +111,16 @@ class WeightLossBot:
                                           reply_markup=botapi.ForceReply.create(selective=True), reply_to_message_id=msg.message_id).join().result
             self.update_loop.register_reply_watch(message=query, function=partial(self.add_contest__set_title, query.message_id))
 
+    @transactional
     def add_contest__set_title(self, original_msg_id, msg):
         query = self.bot.send_message(chat_id=msg.chat.id, text="Start Date of Contest?",
                                       reply_markup=botapi.ForceReply.create(selective=True), reply_to_message_id=msg.message_id).join().result
         self.update_loop.register_reply_watch(message=query, function=partial(self.add_contest__set_date_start, msg.text))
 
+    @transactional
     def add_contest__set_date_start(self, contest_title, msg):
         try:
-            date_start = pytz.timezone("US/Pacific").localize(dtparse(msg.text))  # TODO: Proper timezone support #westcoastbestcoast
+            date_start = self._chat_timezone(msg.chat.id).localize(dtparse(msg.text))
         except ValueError:
             date_start = None
 
@@ -89,7 +129,7 @@ class WeightLossBot:
                                           text="What chapter is the next reading deadline through?",
                                           reply_markup=botapi.ForceReply.create(selective=True),
                                           reply_to_message_id=msg.message_id).join().result
-            self.update_loop.register_reply_watch(message=query, function=partial(self.add_contest__set_date_end, contest_title, date_start, query.message_id))
+            self.update_loop.register_reply_watch(message=query, function=partial(self.add_contest__set_date_end, contest_title, date_start))
         else:
             # TODO: They are still sending more garbage.. Keep asking
             query = self.bot.send_message(chat_id=msg.chat.id, text="Your date could not be processed, try again!",
@@ -98,9 +138,10 @@ class WeightLossBot:
             self.update_loop.register_reply_watch(message=query,
                                                   function=partial(self.add_contest__set_date_start, contest_title))
 
+    @transactional
     def add_contest__set_date_end(self, contest_title, date_start, msg):
         try:
-            date_end = pytz.timezone("US/Pacific").localize(dtparse(msg.text))  # TODO: Proper timezone support #westcoastbestcoast
+            date_end = self._chat_timezone(msg.chat.id).localize(dtparse(msg.text))
         except ValueError:
             date_end = None
 
@@ -120,6 +161,70 @@ class WeightLossBot:
 
     # endregion
 
+    # region export_contest command
+    def _send_contest_export(self, chat_id, contest_id, fmt):
+        contest = DBSession.query(Contest).filter(Contest.id == contest_id).first()
+        if not contest:
+            self.bot.send_message(chat_id=chat_id, text="Contest not found!")
+            return
+
+        # Rows are streamed straight to disk so memory stays flat, then the file is uploaded as a document
+        with tempfile.TemporaryDirectory() as export_dir:
+            file_name = f"contest-{contest.id}.{fmt}"
+            path = os.path.join(export_dir, file_name)
+            try:
+                rows = export_contest(contest.id, path, fmt)
+            except (RuntimeError, OSError) as e:
+                self.logger.exception(f"Could not export contest {contest.id}")
+                self.bot.send_message(chat_id=chat_id, text=f"Error exporting {contest.title}: {e}")
+                return
+
+            with open(path, 'rb') as fp:
+                mime_type = 'text/csv' if fmt == 'csv' else 'application/octet-stream'
+                document = botapi.InputFile('document', botapi.InputFileInfo(file_name, fp, mime_type))
+                result = self.bot.send_document(chat_id=chat_id, document=document, caption=f"{contest.title}: {rows} rows").wait()
+
+            if isinstance(result, botapi.Error):
+                self.logger.warning(f"Could not upload export of contest {contest.id}: {result.description}")
+                self.bot.send_message(chat_id=chat_id, text=f"Error uploading export of {contest.title}: {result.description}")
+
+    @update_metadata
+    def export_contest(self, msg, arguments):
+        args = arguments.split() if arguments else []
+        fmt = args.pop() if args and args[-1] in EXPORT_FORMATS else 'csv'
+
+        try:
+            contest_id = int(args[0]) if args else None
+        except ValueError:
+            contest_id = None
+
+        if contest_id is not None:
+            self._send_contest_export(msg.chat.id, contest_id, fmt)
+            return
+
+        contests = DBSession.query(Contest).order_by(Contest.date_start.desc()).all()
+        if len(contests) == 0:
+            self.bot.send_message(chat_id=msg.chat.id, text="There are no contests to export!", reply_to_message_id=msg.message_id)
+        else:
+            reply = "Which contest do you want to export?"
+
+            keyboard_rows = []
+            for contest in contests:
+                keyboard_rows.append([botapi.InlineKeyboardButton(text=contest.friendly_name, callback_data=str(contest.id))])
+
+            keyboard = botapi.InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+
+            query = self.bot.send_message(chat_id=msg.chat.id, text=reply,
+                                          reply_markup=keyboard, reply_to_message_id=msg.message_id).join().result
+            self.update_loop.register_inline_reply(message=query, srcmsg=msg, function=partial(self.export_contest__select_contest, fmt), permission=Permission.SameUser)
+
+    @transactional
+    def export_contest__select_contest(self, fmt, cbquery, data):
+        self.bot.edit_message_text(chat_id=cbquery.message.chat.id, message_id=cbquery.message.message_id, text="Exporting contest...")
+        self._send_contest_export(cbquery.message.chat.id, int(data), fmt)
+
+    # endregion
+
 
     # User Commands
     # region get_progress command
@@ -494,49 +599,95 @@ class WeightLossBot:
                                        text=f"@{cbquery.sender.username} has quit book {participation.book.friendly_name}!")
 
     # endregion
+"""
+
+    # region weigh_in command
+    @update_metadata
+    def weigh_in(self, msg, arguments):
+        try:
+            weight = int(arguments)
+        except (ValueError, TypeError):
+            weight = None
+
+        participations = UserParticipation.active_for_user(msg.sender.id, datetime.now())
+
+        if len(participations) == 0:
+            self.bot.send_message(chat_id=msg.chat.id, text="You are not in any active contests!", reply_to_message_id=msg.message_id)
+        elif weight is None:
+            self.bot.send_message(chat_id=msg.chat.id, text="Usage: /weigh_in <weight>", reply_to_message_id=msg.message_id)
+        else:
+            try:
+                for participation in participations:
+                    update = ProgressUpdate()
+                    update.participation_id = participation.id
+                    update.progress = weight
+                    DBSession.add(update)
+                DBSession.flush()
+
+                titles = ", ".join(p.contest.title for p in participations)
+                self.bot.send_message(chat_id=msg.chat.id, text=f"Weigh-in of {weight} recorded for {titles}!", reply_to_message_id=msg.message_id)
+            except sqlalchemy.exc.DataError:
+                DBSession.rollback()
+                self.bot.send_message(chat_id=msg.chat.id, text="Error recording weigh-in, number may be too large or invalid.", reply_to_message_id=msg.message_id)
 
+    # endregion
+
+    @transactional
     def inline_query(self, query):
-        pass # Commenting out as I do not believe a viable UI is possible with Telegram's API limitations.
-        # if query.query.startswith("progress "):
-        #     progress = int(re.search(r'\d+', query.query).group())
-        #     user = User.create_or_get(query.sender)
-        #     books = user.active_participation()
-        #
-        #     results = []
-        #
-        #     if len(books) == 0:
-        #         pass  # TODO: Some kind of error?
-        #     else:
-        #         for book in books:
-        #             result_text = f"Set progress for {book.book.friendly_name} to {progress} for {book.book_assignment.chat.username or book.book_assignment.chat.title}"
-        #             desc_text = f"Group: {book.book_assignment.chat.username or book.book_assignment.chat.title}, Set Progress: {progress}"
-        #             keyboard_rows = []
-        #             keyboard_rows.append([botapi.InlineKeyboardButton(text=f"test",
-        #                                                               callback_data=f"fdgdfg")])
-        #
-        #             kbd = botapi.InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
-        #             results.append(botapi.InlineQueryResultArticle(id=f"{book.id},{progress}",
-        #                                                            title=book.book.friendly_name,
-        #                                                            description=desc_text,
-        #                                                            input_message_content=botapi.InputTextMessageContent(message_text=result_text),
-        #                                                            reply_markup=kbd,
-        #                                                            thumb_url=book.book.thumb_url
-        #                                                            )
-        #                            )
-        #
-        #     self.bot.answer_inline_query(inline_query_id=query.id,
-        #                                  results=results,
-        #                                  cache_time=0,
-        #                                  is_personal=True)
-"""
+        """
+        Answered entirely from self.inline_cache, the DB is only hit the first time a user queries after a write.
+        An empty query or "status" lists active contests, a number offers to post /weigh_in with that weight.
+        """
+        text = query.query.strip().lower()
+        entry = self.inline_cache.get(query.sender.id)
 
-    def get_mfp_summary(self, msg, arguments):
-        self.mfp._login()  # hack to refresh login, need to improve library to prevent this need.
+        if text.isdigit():
+            results = InlineAnswerCache.weigh_in_results(entry, int(text), self.bot.username)
+        elif "status".startswith(text):
+            results = entry['status_results']
+        else:
+            results = []
+
+        self.bot.answer_inline_query(inline_query_id=query.id,
+                                     results=results,
+                                     cache_time=INLINE_CACHE_TIME,
+                                     is_personal=True)
 
+    @transactional
+    def get_mfp_summary(self, msg, arguments):
+        timezone = self._chat_timezone(msg.chat.id)
         try:
-            summary_date = pytz.timezone("US/Pacific").localize(dtparse(arguments))  # TODO: Proper timezone support #westcoastbestcoast
+            summary_date = timezone.localize(dtparse(arguments))
         except ValueError:
-            summary_date = date.today() - timedelta(1)
+            summary_date = datetime.now(timezone).date() - timedelta(1)
+
+        message, evaluated = self.build_mfp_summary(summary_date)
+        self.bot.send_message(chat_id=msg.chat.id, text=message, parse_mode="Markdown")
+
+        self._record_compliance(summary_date, evaluated)
+
+    def _fetch_day(self, mfp_username, summary_date, days):
+        if days is None:
+            days = {}
+
+        key = (mfp_username, summary_date.strftime('%Y-%m-%d'))
+        if key not in days:
+            try:
+                days[key] = get_diary_summary(self.mfp, summary_date, mfp_username)
+            except Exception as e:
+                days[key] = e  # Remembered so other chats in the same run do not retry a diary that failed
+
+        if isinstance(days[key], Exception):
+            raise days[key]
+        return days[key]
+
+    def build_mfp_summary(self, summary_date, days=None):
+        """
+        :param days: {(mfp username, date): diary} shared across calls, so a digest run fetches each diary once no
+                     matter how many chats it is posted to
+        :return: (message, [(participant, name, statuses)])
+        """
+        self.mfp._login()  # hack to refresh login, need to improve library to prevent this need.
 
         message = f"MFP Summary for {summary_date.strftime('%Y-%m-%d')}:\n\n"
 
@@ -548,6 +699,7 @@ class WeightLossBot:
 
         message += "```\n"
 
+        evaluated = []
         for user in users:
             if user['mfp'].strip() == "":
                 message += f"{user['name']}: NO MFP SET\n"
@@ -555,7 +707,7 @@ class WeightLossBot:
                 try:
                     mfp_username = user['mfp'].split('/')[-1]
 
-                    day = self.mfp.get_date(summary_date, username=mfp_username)
+                    day = self._fetch_day(mfp_username, summary_date, days)
                     totals = day.totals
 
                     allowed_variance = 0.15
@@ -578,7 +730,11 @@ class WeightLossBot:
                         protein_status = '❌' if totals['protein'] < (user['goal_protein'] * (1 - allowed_variance)) else '✅'
 
 
-                    message += f"{user['name']} tracked {len(list(day.entries))} entries across {len([x for x in day.meals if len(list(x.entries))>0])} meals:"\
+                    statuses = {'Cals': calorie_status, 'NetCarbs': carb_status, 'Fat': fat_status, 'Protein': protein_status}
+                    self.inline_cache.record_compliance(user['telegram'], summary_date, statuses)
+                    evaluated.append((compliance.participant_key(user['telegram']) or mfp_username.lower(), user['name'], statuses))
+
+                    message += f"{user['name']} tracked {day.entry_count} entries across {day.meal_count} meals:"\
                                f"\n    Cals: {totals['calories']}/{user['goal_calories']} {calorie_status}" \
                                f"\n    NetCarbs: {totals['carbohydrates']-totals['fiber']}/{user['goal_carbs']} {carb_status}" \
                                f"\n    Fat: {totals['fat']}/{user['goal_fat']} {fat_status}" \
@@ -588,8 +744,108 @@ class WeightLossBot:
 
         message += "```\n"
         print(message)
+
+        return message, evaluated
+
+    def _record_compliance(self, summary_date, evaluated):
+        summary_day = summary_date.date() if isinstance(summary_date, datetime) else summary_date
+        for attempt in range(2):
+            try:
+                contest_ids = [contest.id for contest in Contest.active_on(summary_day)]
+                for participant, name, statuses in evaluated:
+                    compliance.record_day(participant, name, summary_day, {k: v == '✅' for k, v in statuses.items()}, contest_ids)
+                DBSession.flush()
+                return
+            except sqlalchemy.exc.IntegrityError:
+                # The digest thread and /mfp_summary recorded the same day at once, the retry updates the winner's rows
+                DBSession.rollback()
+                if attempt:
+                    self.logger.exception("Could not record compliance")
+            except sqlalchemy.exc.SQLAlchemyError:
+                DBSession.rollback()
+                self.logger.exception("Could not record compliance")
+                return
+
+    # region digest command
+    @update_metadata
+    def digest(self, msg, arguments):
+        Chat.create_or_get(msg.chat)
+        subscription = DBSession.query(DigestSubscription).filter(DigestSubscription.chat_id == msg.chat.id).first()
+        args = arguments.split() if arguments else []
+
+        if not args:
+            if subscription and subscription.active:
+                text = f"Daily digest is posted at {subscription.post_time.strftime('%H:%M')} {subscription.timezone}."
+            else:
+                text = "No daily digest set, use /digest HH:MM [timezone] to add one."
+            self.bot.send_message(chat_id=msg.chat.id, text=text, reply_to_message_id=msg.message_id)
+            return
+
+        if args[0].lower() == 'off':
+            if subscription:
+                subscription.active = False
+            self.bot.send_message(chat_id=msg.chat.id, text="Daily digest turned off.", reply_to_message_id=msg.message_id)
+            return
+
+        try:
+            post_time = datetime.strptime(args[0], '%H:%M').time()
+            timezone = pytz.timezone(args[1] if len(args) > 1 else (subscription.timezone if subscription else DEFAULT_TIMEZONE)).zone
+        except (ValueError, pytz.UnknownTimeZoneError):
+            self.bot.send_message(chat_id=msg.chat.id, text="Usage: /digest HH:MM [timezone, e.g. US/Pacific] or /digest off", reply_to_message_id=msg.message_id)
+            return
+
+        if not subscription:
+            subscription = DigestSubscription()
+            subscription.chat_id = msg.chat.id
+        subscription.post_time = post_time
+        subscription.timezone = timezone
+        subscription.active = True
+        DBSession.add(subscription)
+
+        self.bot.send_message(chat_id=msg.chat.id, text=f"Daily digest will be posted at {post_time.strftime('%H:%M')} {timezone}.", reply_to_message_id=msg.message_id)
+
+    # endregion
+
+    # region streaks/compliance commands
+    @update_metadata
+    def get_streaks(self, msg, arguments):
+        participant = compliance.participant_key(arguments or '') or compliance.participant_key(msg.sender.username or '')
+        streaks = compliance.participant_streaks(participant) if participant else {}
+
+        if not streaks:
+            self.bot.send_message(chat_id=msg.chat.id, text="No compliance history yet, run /mfp_summary first!", reply_to_message_id=msg.message_id)
+            return
+
+        message = f"Streaks for {streaks['All'].name or participant}:\n```\n"
+        for nutrient in compliance.NUTRIENTS:
+            if nutrient in streaks:
+                streak = streaks[nutrient]
+                message += f"{nutrient}: {streak.current_streak} days (best {streak.longest_streak})\n"
+        message += "```\n"
+
+        self.bot.send_message(chat_id=msg.chat.id, text=message, parse_mode="Markdown", reply_to_message_id=msg.message_id)
+
+    @update_metadata
+    def get_compliance(self, msg, arguments):
+        contests = Contest.active_on(datetime.now(self._chat_timezone(msg.chat.id)).date())
+        scopes = [(contest.title, contest.id) for contest in contests] or [("All time", None)]
+
+        message = ""
+        for title, contest_id in scopes:
+            by_participant = compliance.contest_compliance(contest_id)
+            message += f"Compliance for {title}:\n```\n"
+            if not by_participant:
+                message += "No days evaluated yet\n"
+            for participant, streaks in sorted(by_participant.items(), key=lambda x: -x[1]['All'].compliance_pct if 'All' in x[1] else 0):
+                overall = streaks.get('All')
+                message += f"{overall.name or participant}: {overall.compliance_pct:.0f}% of {overall.days_evaluated} days\n    " + \
+                           " ".join(f"{n} {streaks[n].compliance_pct:.0f}%" for n in compliance.NUTRIENTS[:-1] if n in streaks) + "\n"
+            message += "```\n"
+
         self.bot.send_message(chat_id=msg.chat.id, text=message, parse_mode="Markdown")
 
+    # endregion
+
     def _get_participants(self):
         """
         TODO: This is completely hardcoded to the DM contest... figure out how to make it more flexible
@@ -616,6 +872,7 @@ class WeightLossBot:
         return users
 
     def run(self):
+        self.digest_scheduler.start()
         self.update_loop.run()  # Run update loop and register as handler
 
 
@@ -626,9 +883,8 @@ if __name__ == '__main__':
     configfile = configparser.ConfigParser()
     configfile.read('config.ini')
 
-    # engine = engine_from_config(configfile['WeightLossBot'], 'sqlalchemy.')
-    # DBSession.configure(bind=engine)
-    # Base.metadata.create_all(engine)
+    engine = engine_from_config(configfile['WeightLossBot'], 'sqlalchemy.')
+    DBSession.configure(bind=engine)  # Schema is managed by alembic, run `alembic upgrade head` first
 
     mybot = WeightLossBot(configfile)
     mybot.run()
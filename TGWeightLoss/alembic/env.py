@@ -20,7 +20,7 @@ import sys
 import os
 parent_dir = os.path.abspath(os.path.join(os.getcwd(), ".."))
 sys.path.append(parent_dir)
-from TGBookClubBot import models
+from TGWeightLoss import models
 target_metadata = models.Base.metadata
 
 # other values from the config, defined by the needs of env.py,
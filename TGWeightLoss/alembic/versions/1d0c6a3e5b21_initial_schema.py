@@ -0,0 +1,70 @@
+"""initial schema
+
+Tables as the bot created them before migrations existed. A database made back then with create_all already has
+them: run `alembic stamp 1d0c6a3e5b21` once, then `alembic upgrade head`.
+
+Revision ID: 1d0c6a3e5b21
+Revises: 
+Create Date: 2026-10-19 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d0c6a3e5b21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chat',
+                    sa.Column('id', sa.BigInteger(), nullable=False),
+                    sa.Column('type', sa.String(), nullable=True),
+                    sa.Column('title', sa.String(), nullable=True),
+                    sa.Column('username', sa.String(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+
+    op.create_table('user',
+                    sa.Column('id', sa.BigInteger(), nullable=False),
+                    sa.Column('first_name', sa.String(), nullable=True),
+                    sa.Column('last_name', sa.String(), nullable=True),
+                    sa.Column('username', sa.String(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+
+    op.create_table('contest',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('title', sa.String(), nullable=True),
+                    sa.Column('date_start', sa.DateTime(), nullable=True),
+                    sa.Column('date_end', sa.DateTime(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+
+    op.create_table('user_participation',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('join_date', sa.DateTime(), nullable=True),
+                    sa.Column('goal_weight', sa.Integer(), nullable=True),
+                    sa.Column('start_weight', sa.Integer(), nullable=True),
+                    sa.Column('user_id', sa.BigInteger(), nullable=True),
+                    sa.Column('contest_id', sa.Integer(), nullable=True),
+                    sa.Column('active', sa.Boolean(), nullable=True),
+                    sa.ForeignKeyConstraint(['contest_id'], ['contest.id'], ),
+                    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+                    sa.PrimaryKeyConstraint('id'))
+
+    op.create_table('progress_update',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('update_date', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('progress', sa.Integer(), nullable=True),
+                    sa.Column('participation_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['participation_id'], ['user_participation.id'], ),
+                    sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('progress_update')
+    op.drop_table('user_participation')
+    op.drop_table('contest')
+    op.drop_table('user')
+    op.drop_table('chat')
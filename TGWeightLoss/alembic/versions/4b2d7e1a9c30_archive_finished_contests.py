@@ -0,0 +1,58 @@
+"""archive finished contests
+
+Revision ID: 4b2d7e1a9c30
+Revises: 1d0c6a3e5b21
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b2d7e1a9c30'
+down_revision = '1d0c6a3e5b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('contest') as batch_op:
+        batch_op.add_column(sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=True))
+        batch_op.add_column(sa.Column('archive_path', sa.String(), nullable=True))
+
+    op.create_index(op.f('ix_progress_update_participation_id'), 'progress_update', ['participation_id'], unique=False)
+
+    op.create_table('progress_update_archive',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('update_date', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('progress', sa.Integer(), nullable=True),
+                    sa.Column('participation_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['participation_id'], ['user_participation.id'], ),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_progress_update_archive_participation_id'), 'progress_update_archive', ['participation_id'], unique=False)
+
+    op.create_table('participation_summary',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('first_update_date', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('last_update_date', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('start_progress', sa.Integer(), nullable=True),
+                    sa.Column('end_progress', sa.Integer(), nullable=True),
+                    sa.Column('min_progress', sa.Integer(), nullable=True),
+                    sa.Column('update_count', sa.Integer(), nullable=True),
+                    sa.Column('weekly_series', sa.Text(), nullable=True),
+                    sa.Column('participation_id', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['participation_id'], ['user_participation.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('participation_id'))
+
+
+def downgrade():
+    op.drop_table('participation_summary')
+    op.drop_index(op.f('ix_progress_update_archive_participation_id'), table_name='progress_update_archive')
+    op.drop_table('progress_update_archive')
+    op.drop_index(op.f('ix_progress_update_participation_id'), table_name='progress_update')
+
+    with op.batch_alter_table('contest') as batch_op:
+        batch_op.drop_column('archive_path')
+        batch_op.drop_column('archived')
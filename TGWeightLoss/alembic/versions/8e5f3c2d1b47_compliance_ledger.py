@@ -0,0 +1,61 @@
+"""compliance ledger
+
+Revision ID: 8e5f3c2d1b47
+Revises: 4b2d7e1a9c30
+Create Date: 2026-10-19 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e5f3c2d1b47'
+down_revision = '4b2d7e1a9c30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('compliance_record',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('participant', sa.String(length=64), nullable=False),
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('nutrient', sa.SmallInteger(), nullable=False),
+                    sa.Column('contest_id', sa.Integer(), nullable=True),
+                    sa.Column('compliant', sa.Boolean(), nullable=False),
+                    sa.ForeignKeyConstraint(['contest_id'], ['contest.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('participant', 'day', 'nutrient', 'contest_id', name='uq_compliance_record_participant_day_nutrient_contest'))
+    op.create_index('uq_compliance_record_participant_day_nutrient_all_time', 'compliance_record', ['participant', 'day', 'nutrient'], unique=True,
+                    postgresql_where=sa.text('contest_id IS NULL'), sqlite_where=sa.text('contest_id IS NULL'))
+    op.create_index('ix_compliance_record_participant_nutrient_day', 'compliance_record', ['participant', 'nutrient', 'day'], unique=False)
+
+    op.create_table('compliance_streak',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('participant', sa.String(length=64), nullable=False),
+                    sa.Column('name', sa.String(), nullable=True),
+                    sa.Column('nutrient', sa.SmallInteger(), nullable=False),
+                    sa.Column('contest_id', sa.Integer(), nullable=True),
+                    sa.Column('last_day', sa.Date(), nullable=True),
+                    sa.Column('current_streak', sa.Integer(), nullable=True),
+                    sa.Column('streak_before_last_day', sa.Integer(), nullable=True),
+                    sa.Column('longest_before_last_day', sa.Integer(), nullable=True),
+                    sa.Column('longest_streak', sa.Integer(), nullable=True),
+                    sa.Column('days_evaluated', sa.Integer(), nullable=True),
+                    sa.Column('days_compliant', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['contest_id'], ['contest.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('participant', 'nutrient', 'contest_id', name='uq_compliance_streak_participant_nutrient_contest'))
+    op.create_index('uq_compliance_streak_participant_nutrient_all_time', 'compliance_streak', ['participant', 'nutrient'], unique=True,
+                    postgresql_where=sa.text('contest_id IS NULL'), sqlite_where=sa.text('contest_id IS NULL'))
+    op.create_index('ix_compliance_streak_contest', 'compliance_streak', ['contest_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_compliance_streak_contest', table_name='compliance_streak')
+    op.drop_index('uq_compliance_streak_participant_nutrient_all_time', table_name='compliance_streak')
+    op.drop_table('compliance_streak')
+    op.drop_index('ix_compliance_record_participant_nutrient_day', table_name='compliance_record')
+    op.drop_index('uq_compliance_record_participant_day_nutrient_all_time', table_name='compliance_record')
+    op.drop_table('compliance_record')
@@ -0,0 +1,33 @@
+"""digest subscriptions
+
+Revision ID: c1a7d9e2f604
+Revises: 8e5f3c2d1b47
+Create Date: 2026-10-19 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c1a7d9e2f604'
+down_revision = '8e5f3c2d1b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('digest_subscription',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('chat_id', sa.BigInteger(), nullable=True),
+                    sa.Column('post_time', sa.Time(), nullable=True),
+                    sa.Column('timezone', sa.String(), nullable=True),
+                    sa.Column('active', sa.Boolean(), nullable=True),
+                    sa.Column('last_posted', sa.Date(), nullable=True),
+                    sa.ForeignKeyConstraint(['chat_id'], ['chat.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('chat_id'))
+
+
+def downgrade():
+    op.drop_table('digest_subscription')
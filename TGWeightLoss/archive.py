@@ -0,0 +1,264 @@
+# Standard Library
+import argparse
+import configparser
+import gzip
+import json
+import os.path
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse as dtparse
+from sqlalchemy import engine_from_config
+
+from TGWeightLoss.models import *
+
+# Contest dates are chat-local wall time while /weigh_in checks them against the server's local clock, so a contest
+# is only archived once it ended longer ago than any timezone offset between the two, plus a day of late weigh-ins
+ARCHIVE_GRACE = timedelta(days=2)
+
+
+def _naive(dt):
+    if dt is not None and dt.tzinfo is not None:
+        return dt.replace(tzinfo=None)
+    return dt
+
+
+def _archive_path(archive_dir, contest):
+    return os.path.abspath(os.path.join(archive_dir, f"contest-{contest.id}.jsonl.gz"))
+
+
+class _SummaryBuilder:
+    """
+    Folds a participation's updates (in update_date order) into a ParticipationSummary one row at a time
+    """
+    def __init__(self, participation_id, date_start):
+        self.participation_id = participation_id
+        self.date_start = _naive(date_start)
+        self.first = None
+        self.last = None
+        self.min_progress = None
+        self.count = 0
+        self.weeks = {}
+
+    def add(self, update_date, progress):
+        if self.first is None:
+            self.first = (update_date, progress)
+        self.last = (update_date, progress)
+        self.count += 1
+
+        if progress is not None:
+            if self.min_progress is None or progress < self.min_progress:
+                self.min_progress = progress
+            if update_date is not None and self.date_start is not None:
+                self.weeks[(_naive(update_date) - self.date_start).days // 7] = progress
+
+    def build(self):
+        summary = DBSession.query(ParticipationSummary) \
+            .filter(ParticipationSummary.participation_id == self.participation_id).first()
+        if not summary:
+            summary = ParticipationSummary()
+            summary.participation_id = self.participation_id
+
+        summary.first_update_date, summary.start_progress = self.first or (None, None)
+        summary.last_update_date, summary.end_progress = self.last or (None, None)
+        summary.min_progress = self.min_progress
+        summary.update_count = self.count
+        summary.weekly_series = json.dumps(sorted(self.weeks.items()))
+
+        return summary
+
+
+def _contest_updates(contest):
+    return DBSession.query(ProgressUpdate) \
+        .join(UserParticipation) \
+        .filter(UserParticipation.contest_id == contest.id)
+
+
+def archive_contest(contest, archive_dir=None, batch_size=1000, now=None):
+    """
+    Compact a finished contest into one ParticipationSummary per participation and move its raw ProgressUpdate
+    rows out of the hot table, either into progress_update_archive or, when archive_dir is set, a gzipped JSONL file.
+    Where the rows went is kept in Contest.archive_path for restore_contest.
+    :param now: local time, as used by /weigh_in
+    :return: number of ProgressUpdate rows moved
+    """
+    if contest.archived:
+        raise ValueError(f"Contest {contest.id} is already archived")
+
+    now = now or datetime.now()
+    if contest.date_end is None or _naive(contest.date_end) >= now - ARCHIVE_GRACE:
+        raise ValueError(f"Contest {contest.id} may still take weigh-ins, it can be archived {ARCHIVE_GRACE.days} days after it ends")
+
+    participation_ids = [p.id for p in contest.participants]
+    builders = {pid: _SummaryBuilder(pid, contest.date_start) for pid in participation_ids}
+
+    # 'x' so an archive left behind by an earlier run is never truncated
+    path = _archive_path(archive_dir, contest) if archive_dir is not None else None
+    archive_file = gzip.open(path, 'xt') if path is not None else None
+    moved = 0
+    try:
+        try:
+            rows = _contest_updates(contest) \
+                .order_by(ProgressUpdate.participation_id, ProgressUpdate.update_date, ProgressUpdate.id) \
+                .yield_per(batch_size)
+
+            pending = []
+            for update in rows:
+                builders[update.participation_id].add(update.update_date, update.progress)
+                moved += 1
+
+                if archive_file is not None:
+                    archive_file.write(json.dumps({
+                        'id': update.id,
+                        'update_date': update.update_date.isoformat() if update.update_date is not None else None,
+                        'progress': update.progress,
+                        'participation_id': update.participation_id,
+                    }) + "\n")
+                else:
+                    pending.append({
+                        'id': update.id,
+                        'update_date': update.update_date,
+                        'progress': update.progress,
+                        'participation_id': update.participation_id,
+                    })
+                    if len(pending) >= batch_size:
+                        DBSession.bulk_insert_mappings(ArchivedProgressUpdate, pending)
+                        pending = []
+
+            if pending:
+                DBSession.bulk_insert_mappings(ArchivedProgressUpdate, pending)
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+
+        for builder in builders.values():
+            DBSession.add(builder.build())
+
+        if participation_ids:
+            DBSession.query(ProgressUpdate) \
+                .filter(ProgressUpdate.participation_id.in_(participation_ids)) \
+                .delete(synchronize_session=False)
+
+        contest.archived = True
+        contest.archive_path = path
+        DBSession.add(contest)
+        DBSession.commit()
+    except BaseException:
+        DBSession.rollback()
+        # The rows are still in progress_update, drop the partial copy so archiving can be retried
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        raise
+
+    return moved
+
+
+def restore_contest(contest, batch_size=1000):
+    """
+    Move an archived contest's raw rows back into progress_update, from wherever archive_contest put them.
+    Summaries are kept and get rebuilt on re-archive.
+    :return: number of ProgressUpdate rows restored
+    """
+    if not contest.archived:
+        raise ValueError(f"Contest {contest.id} is not archived")
+
+    participation_ids = [p.id for p in contest.participants]
+    restored = 0
+
+    def flush(pending):
+        DBSession.bulk_insert_mappings(ProgressUpdate, pending)
+        return len(pending)
+
+    path = contest.archive_path
+    if path is not None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Archive of contest {contest.id} not found at {path}")
+
+        pending = []
+        with gzip.open(path, 'rt') as archive_file:
+            for line in archive_file:
+                row = json.loads(line)
+                if row['update_date'] is not None:
+                    row['update_date'] = dtparse(row['update_date'])
+                pending.append(row)
+                if len(pending) >= batch_size:
+                    restored += flush(pending)
+                    pending = []
+        if pending:
+            restored += flush(pending)
+    elif participation_ids:
+        archived = DBSession.query(ArchivedProgressUpdate) \
+            .filter(ArchivedProgressUpdate.participation_id.in_(participation_ids)) \
+            .yield_per(batch_size)
+
+        pending = []
+        for row in archived:
+            pending.append({
+                'id': row.id,
+                'update_date': row.update_date,
+                'progress': row.progress,
+                'participation_id': row.participation_id,
+            })
+            if len(pending) >= batch_size:
+                restored += flush(pending)
+                pending = []
+        if pending:
+            restored += flush(pending)
+
+        DBSession.query(ArchivedProgressUpdate) \
+            .filter(ArchivedProgressUpdate.participation_id.in_(participation_ids)) \
+            .delete(synchronize_session=False)
+
+    contest.archived = False
+    contest.archive_path = None
+    DBSession.add(contest)
+    DBSession.commit()
+
+    if path is not None:
+        os.remove(path)
+
+    return restored
+
+
+def archive_finished_contests(now=None, archive_dir=None):
+    """
+    :param now: local time, as used by /weigh_in
+    """
+    now = now or datetime.now()
+    return {contest.id: archive_contest(contest, archive_dir=archive_dir, now=now)
+            for contest in Contest.finished(now - ARCHIVE_GRACE)}
+
+
+if __name__ == '__main__':
+    # Run as script
+    parser = argparse.ArgumentParser(description="Archive or restore ProgressUpdate history of finished contests.")
+    parser.add_argument('action', choices=['archive', 'restore'])
+    parser.add_argument('contest_id', type=int, nargs='?', help="Contest to act on, defaults to every finished contest when archiving")
+    parser.add_argument('--archive-dir', help="Write raw rows to gzipped JSONL files here instead of the archive table. "
+                                              "Restoring reads them from wherever they were archived.")
+    args = parser.parse_args()
+
+    if not os.path.exists("config.ini"):
+        exit("Config file not found!")
+    configfile = configparser.ConfigParser()
+    configfile.read('config.ini')
+
+    engine = engine_from_config(configfile['WeightLossBot'], 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+
+    try:
+        if args.contest_id is not None:
+            contest = DBSession.query(Contest).filter(Contest.id == args.contest_id).first()
+            if not contest:
+                exit(f"Contest {args.contest_id} not found!")
+
+            if args.action == 'archive':
+                print(f"Archived {archive_contest(contest, archive_dir=args.archive_dir)} updates from {contest.friendly_name}")
+            else:
+                print(f"Restored {restore_contest(contest)} updates to {contest.friendly_name}")
+        elif args.action == 'archive':
+            for contest_id, moved in archive_finished_contests(archive_dir=args.archive_dir).items():
+                print(f"Archived {moved} updates from contest {contest_id}")
+        else:
+            exit("A contest_id is required to restore!")
+    except (ValueError, OSError) as e:
+        exit(str(e))
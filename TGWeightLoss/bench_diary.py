@@ -0,0 +1,114 @@
+# Standard Library
+import argparse
+import hashlib
+import time
+import tracemalloc
+
+import lxml.html
+
+from TGWeightLoss.diary import DiaryTotalsParser
+
+COLUMNS = ['Calories', 'Carbs', 'Fat', 'Protein', 'Sodium', 'Sugar', 'Fiber']
+MEALS = ['Breakfast', 'Lunch', 'Dinner', 'Snacks']
+
+
+def synthetic_diary_html(seed, entries_per_meal=8, meals=MEALS):
+    """
+    Deterministic food diary page laid out like MFP's, with a totals row matching its entries
+    """
+    digest = int(hashlib.md5(str(seed).encode()).hexdigest(), 16)
+    header = "".join(f"<td class=\"alt\">{column}</td>" for column in COLUMNS)
+
+    rows = []
+    totals = [0] * len(COLUMNS)
+    for m, meal in enumerate(meals):
+        rows.append(f"<tr class=\"meal_header\"><td class=\"first alt\">{meal}</td>{header}</tr>")
+        for e in range((digest >> (4 * m)) % (entries_per_meal + 1)):
+            values = [(digest >> (m + e + c)) % 300 for c in range(len(COLUMNS))]
+            totals = [t + v for t, v in zip(totals, values)]
+            cells = "".join(f"<td><span class=\"macro-value\">{v:,}</span><span class=\"macro-percentage\">5</span></td>" for v in values)
+            rows.append(f"<tr><td class=\"first alt\"><a href=\"#\">Food {m}-{e}</a></td>{cells}"
+                        f"<td class=\"delete\"><a href=\"#\"><img alt=\"Delete\"/></a></td></tr>")
+        rows.append("<tr class=\"bottom\"><td class=\"first alt\"><a href=\"#\">Add Food</a> Quick Tools</td></tr>")
+        rows.append("<tr class=\"spacer\"><td class=\"first\"></td></tr>")
+
+    total_cells = "".join(f"<td>{t:,}</td>" for t in totals)
+    goal_cells = "".join(f"<td>{g:,}</td>" for g in [1800, 30, 120, 100, 2300, 25, 25])
+    return (f"<html><head><title>Food Diary</title></head><body><div id=\"content\">"
+            f"<table class=\"table0\" id=\"diary-table\"><tbody>{''.join(rows)}</tbody><tfoot>"
+            f"<tr class=\"total\"><td class=\"first\">Totals</td>{total_cells}<td></td></tr>"
+            f"<tr class=\"total alt\"><td class=\"first\">Your Daily Goal</td>{goal_cells}<td></td></tr>"
+            f"</tfoot></table><div id=\"complete_day\"><p class=\"day_incomplete_message\">Not complete</p></div>"
+            f"{'<p>footer</p>' * 200}</div></body></html>").encode('utf8')
+
+
+def full_parse(client, html):
+    """
+    What get_mfp_summary did before: full lxml tree, Meal/Entry objects, totals summed from entries
+    """
+    import myfitnesspal.day
+
+    document = lxml.html.document_fromstring(html.decode('utf8'))
+    day = myfitnesspal.day.Day(date=None, meals=client._get_meals(document), goals=client._get_goals(document))
+    return day.totals, len(list(day.entries)), len([x for x in day.meals if len(list(x.entries)) > 0])
+
+
+def lean_parse(client, html, chunk_size=16384):
+    parser = DiaryTotalsParser(client._get_full_name if client else None)
+    for offset in range(0, len(html), chunk_size):
+        parser.feed(html[offset:offset + chunk_size])
+        if parser.done:
+            break
+    summary = parser.close()
+    return summary.totals, summary.entry_count, summary.meal_count
+
+
+def _measure(function, pages):
+    """
+    :return: (results, seconds, largest Python heap growth while parsing one page). libxml2's own buffers are not
+             seen by tracemalloc.
+    """
+    function(pages[0])  # Warm up imports and regex caches outside the measurement
+
+    start = time.perf_counter()
+    results = [function(page) for page in pages]
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    tracemalloc.start()
+    for page in pages:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        function(page)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return results, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the full myfitnesspal diary parse against the lean totals-only parse.")
+    parser.add_argument('--participants', type=int, default=200)
+    parser.add_argument('--entries-per-meal', type=int, default=15)
+    args = parser.parse_args()
+
+    pages = [synthetic_diary_html(i, args.entries_per_meal) for i in range(args.participants)]
+
+    try:
+        import myfitnesspal
+        client = myfitnesspal.Client('benchmark', password='', login=False)
+    except ImportError:
+        client = None
+
+    lean, lean_time, lean_peak = _measure(lambda page: lean_parse(client, page), pages)
+    print(f"lean: {lean_time * 1000 / len(pages):.2f} ms/participant, peak Python heap per participant {lean_peak / 1024:.0f} KiB")
+
+    if client is None:
+        exit("myfitnesspal is not installed, skipping the full parse")
+
+    full, full_time, full_peak = _measure(lambda page: full_parse(client, page), pages)
+    print(f"full: {full_time * 1000 / len(pages):.2f} ms/participant, peak Python heap per participant {full_peak / 1024:.0f} KiB")
+    print(f"speedup {full_time / lean_time:.1f}x, peak memory {full_peak / max(lean_peak, 1):.1f}x lower")
+
+    mismatches = [i for i, (a, b) in enumerate(zip(full, lean)) if a[1:] != b[1:] or any(a[0].get(k) != v for k, v in b[0].items())]
+    print(f"{len(mismatches)} participants differ between parsers")
@@ -0,0 +1,128 @@
+from datetime import timedelta
+
+from TGWeightLoss.models import *
+
+# Order matters, the index is what ComplianceRecord.nutrient and ComplianceStreak.nutrient store
+NUTRIENTS = ['Cals', 'NetCarbs', 'Fat', 'Protein', 'All']
+ALL = NUTRIENTS.index('All')
+
+
+def participant_key(telegram):
+    return telegram.strip().lstrip('@').lower() or None
+
+
+def _apply(streak, day, compliant, previous):
+    """
+    Fold one day into a streak row without looking at history. previous is the outcome this row already counted for
+    that day, if any. Re-evaluating last_day is exact; re-evaluating or back-filling older days only moves the
+    compliance percentage, streaks are kept as they are.
+    """
+    if previous is not None:
+        if previous == compliant:
+            return
+        streak.days_compliant += 1 if compliant else -1
+        if day == streak.last_day:
+            streak.current_streak = streak.streak_before_last_day + 1 if compliant else 0
+            streak.longest_streak = max(streak.longest_before_last_day, streak.current_streak)
+        return
+
+    streak.days_evaluated += 1
+    streak.days_compliant += 1 if compliant else 0
+
+    if streak.last_day is not None and day <= streak.last_day:
+        return
+
+    consecutive = streak.last_day is not None and day == streak.last_day + timedelta(1)
+    streak.streak_before_last_day = streak.current_streak if consecutive else 0
+    streak.longest_before_last_day = streak.longest_streak
+    streak.current_streak = streak.streak_before_last_day + 1 if compliant else 0
+    streak.longest_streak = max(streak.longest_streak, streak.current_streak)
+    streak.last_day = day
+
+
+def _streaks(participant, name, contest_ids):
+    rows = DBSession.query(ComplianceStreak).filter(ComplianceStreak.participant == participant).all()
+    streaks = {(row.nutrient, row.contest_id): row for row in rows}
+
+    for nutrient in range(len(NUTRIENTS)):
+        for contest_id in [None] + contest_ids:
+            if (nutrient, contest_id) not in streaks:
+                streak = ComplianceStreak(participant=participant, nutrient=nutrient, contest_id=contest_id,
+                                          current_streak=0, streak_before_last_day=0, longest_streak=0,
+                                          longest_before_last_day=0, days_evaluated=0, days_compliant=0)
+                DBSession.add(streak)
+                streaks[(nutrient, contest_id)] = streak
+            streaks[(nutrient, contest_id)].name = name
+
+    return streaks
+
+
+def record_day(participant, name, day, outcomes, contest_ids=()):
+    """
+    Store one participant's evaluated day and update their streak counters, all-time and for each contest running
+    that day. Does not commit.
+    :param outcomes: {nutrient name: compliant bool} for the entries of NUTRIENTS except All
+    """
+    outcomes = dict(outcomes)
+    outcomes['All'] = all(outcomes.values())
+
+    # A contest counter only counted the days recorded while the contest was known, so every scope has its own records
+    existing = {(row.nutrient, row.contest_id): row for row in DBSession.query(ComplianceRecord)
+                .filter(ComplianceRecord.participant == participant)
+                .filter(ComplianceRecord.day == day).all()}
+    streaks = _streaks(participant, name, list(contest_ids))
+
+    for nutrient_name, compliant in outcomes.items():
+        nutrient = NUTRIENTS.index(nutrient_name)
+
+        for contest_id in [None] + list(contest_ids):
+            record = existing.get((nutrient, contest_id))
+            previous = record.compliant if record is not None else None
+            if record is None:
+                record = ComplianceRecord(participant=participant, day=day, nutrient=nutrient, contest_id=contest_id)
+            record.compliant = compliant
+            DBSession.add(record)
+
+            _apply(streaks[(nutrient, contest_id)], day, compliant, previous)
+
+
+def participant_streaks(participant, contest_id=None):
+    """
+    :return: {nutrient name: ComplianceStreak}
+    """
+    rows = DBSession.query(ComplianceStreak) \
+        .filter(ComplianceStreak.participant == participant) \
+        .filter(ComplianceStreak.contest_id == contest_id if contest_id is not None else ComplianceStreak.contest_id.is_(None)) \
+        .all()
+    return {NUTRIENTS[row.nutrient]: row for row in rows}
+
+
+def contest_compliance(contest_id=None):
+    """
+    :return: {participant: {nutrient name: ComplianceStreak}} for every participant with counters in the contest
+    """
+    rows = DBSession.query(ComplianceStreak) \
+        .filter(ComplianceStreak.contest_id == contest_id if contest_id is not None else ComplianceStreak.contest_id.is_(None)) \
+        .all()
+
+    result = {}
+    for row in rows:
+        result.setdefault(row.participant, {})[NUTRIENTS[row.nutrient]] = row
+    return result
+
+
+def latest_day(participant):
+    """
+    :return: (day, {nutrient name: compliant}) of the most recent evaluated day, or None
+    """
+    day = DBSession.query(func.max(ComplianceRecord.day)) \
+        .filter(ComplianceRecord.participant == participant) \
+        .filter(ComplianceRecord.contest_id.is_(None)).scalar()
+    if day is None:
+        return None
+
+    rows = DBSession.query(ComplianceRecord) \
+        .filter(ComplianceRecord.participant == participant) \
+        .filter(ComplianceRecord.contest_id.is_(None)) \
+        .filter(ComplianceRecord.day == day).all()
+    return day, {NUTRIENTS[row.nutrient]: row.compliant for row in rows if row.nutrient != ALL}
@@ -0,0 +1,118 @@
+# Standard Library
+import re
+
+from lxml import etree
+
+
+class DiarySummary:
+    """
+    The part of a myfitnesspal.Day that get_mfp_summary uses: totals, number of entries and number of meals with
+    at least one entry
+    """
+    def __init__(self, totals, entry_count, meal_count):
+        self.totals = totals
+        self.entry_count = entry_count
+        self.meal_count = meal_count
+
+
+class DiaryTotalsParser:
+    """
+    Incremental parser for an MFP food diary page. Rows are handled as they close and dropped right after, so no
+    document tree is kept; entries are only counted, and parsing stops at the totals row.
+
+    Rows are read the same way myfitnesspal.Client does: the first meal_header gives the column names, unclassed
+    rows after a meal_header are entries, and the first tr.total holds the day's totals.
+    """
+    def __init__(self, full_name=None):
+        self.full_name = full_name or (lambda name: name.lower().strip())
+        self.parser = etree.HTMLPullParser(events=('end',), tag='tr', encoding='utf-8')
+        self.fields = None
+        self.in_meal = False
+        self.meal_entries = 0
+        self.entry_count = 0
+        self.meal_count = 0
+        self.totals = None
+
+    @property
+    def done(self):
+        return self.totals is not None
+
+    @staticmethod
+    def _numeric(text):
+        digits = re.sub(r'[^\d.]+', '', text or '')
+        return int(float(digits)) if digits else None
+
+    def _value(self, td):
+        span = td.find("span[@class='macro-value']")
+        return self._numeric(span.text if span is not None else td.text)
+
+    def _end_meal(self):
+        if self.in_meal and self.meal_entries > 0:
+            self.meal_count += 1
+        self.in_meal = False
+        self.meal_entries = 0
+
+    def _row(self, tr):
+        row_class = tr.get('class')
+
+        if row_class == 'meal_header':
+            self._end_meal()
+            if self.fields is None:
+                self.fields = ['name'] + [self.full_name(td.text or '') for td in tr.findall('td')[1:]]
+            self.in_meal = True
+        elif row_class is None:
+            if self.in_meal:
+                self.meal_entries += 1
+                self.entry_count += 1
+        elif row_class == 'total':
+            self._end_meal()
+            totals = {}
+            for field, td in zip(self.fields or [], tr.findall('td')):
+                if field == 'name':
+                    continue
+                value = self._value(td)
+                if value is not None:
+                    totals[field] = value
+            self.totals = totals
+        else:
+            self._end_meal()
+
+    def feed(self, data):
+        if self.done:
+            return
+        self.parser.feed(data)
+        for _, tr in self.parser.read_events():
+            if not self.done:
+                self._row(tr)
+            # Drop the row and everything parsed before it, memory stays at one row no matter the diary size
+            tr.clear()
+            while tr.getprevious() is not None:
+                del tr.getparent()[0]
+
+    def close(self):
+        if not self.done:
+            self.parser.close()
+            for _, tr in self.parser.read_events():
+                if not self.done:
+                    self._row(tr)
+            self._end_meal()
+
+        # A day with nothing logged has no totals, like summing the entries of myfitnesspal.Day
+        return DiarySummary(self.totals if self.entry_count else {}, self.entry_count, self.meal_count)
+
+
+def get_diary_summary(client, summary_date, username, chunk_size=16384):
+    """
+    Lean stand-in for client.get_date(...) when only totals and counts are needed. Streams the diary page through
+    DiaryTotalsParser and stops downloading once the totals row is read.
+    """
+    response = client._get_request_for_url(client._get_url_for_date(summary_date, username), stream=True)
+    parser = DiaryTotalsParser(client._get_full_name)
+    try:
+        for chunk in response.iter_content(chunk_size):
+            parser.feed(chunk)
+            if parser.done:
+                break
+    finally:
+        response.close()
+    return parser.close()
@@ -0,0 +1,133 @@
+# Standard Library
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytz
+from twx import botapi
+
+from TGWeightLoss.models import *
+
+DIGEST_SEND_RATE = 25  # Messages per second across all chats, Telegram allows about 30
+DIGEST_CHECK_INTERVAL = 30  # Seconds between looking for due subscriptions
+
+
+class SendRateLimiter:
+    """
+    Hands out send slots spaced 1/rate seconds apart, shared by every thread that posts
+    """
+    def __init__(self, rate=DIGEST_SEND_RATE):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def back_off(self, seconds):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def due_subscriptions(now):
+    """
+    :param now: aware datetime
+    :return: [(subscription id, chat id, local date)] of active subscriptions whose post time has passed today in
+             their own timezone and that have not been posted yet today
+    """
+    due = []
+    for subscription in DBSession.query(DigestSubscription).filter(DigestSubscription.active == True).all():
+        local_now = now.astimezone(pytz.timezone(subscription.timezone or DEFAULT_TIMEZONE))
+        if subscription.post_time is None or local_now.time() < subscription.post_time:
+            continue
+        if subscription.last_posted == local_now.date():
+            continue
+        due.append((subscription.id, subscription.chat_id, local_now.date()))
+    return due
+
+
+class DigestScheduler(threading.Thread):
+    """
+    Posts the daily MFP summary to every subscribed chat. Chats are grouped by the day they need summarized, each
+    group's summary (and every diary behind it) is built once, and sends are spread out by a SendRateLimiter.
+    """
+    def __init__(self, weightloss_bot, rate=DIGEST_SEND_RATE, interval=DIGEST_CHECK_INTERVAL):
+        super().__init__(name="DigestScheduler", daemon=True)
+        self.weightloss_bot = weightloss_bot
+        self.limiter = SendRateLimiter(rate)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("DigestScheduler")
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                self.logger.exception("Digest run failed")
+            self.stopped.wait(self.interval)
+
+    def tick(self, now=None):
+        now = now or datetime.now(pytz.utc)
+
+        with unit_of_work():
+            due = due_subscriptions(now)
+
+        by_summary_date = defaultdict(list)
+        for subscription_id, chat_id, local_date in due:
+            by_summary_date[local_date - timedelta(1)].append((subscription_id, chat_id, local_date))
+
+        days = {}  # Shared diary cache for this run
+        for summary_date, subscriptions in by_summary_date.items():
+            with unit_of_work():
+                message, evaluated = self.weightloss_bot.build_mfp_summary(summary_date, days)
+                self.weightloss_bot._record_compliance(summary_date, evaluated)
+
+            # A failed post still uses up the day, otherwise every tick would rebuild the summary for a dead chat
+            attempted = {}
+            blocked = []
+            for subscription_id, chat_id, local_date in subscriptions:
+                attempted[subscription_id] = local_date
+                error = self._send(chat_id, message)
+                if error is not None and error.error_code == 403:
+                    blocked.append(subscription_id)
+
+            with unit_of_work():
+                for subscription_id, local_date in attempted.items():
+                    values = {'last_posted': local_date}
+                    if subscription_id in blocked:
+                        values['active'] = False  # Kicked from the chat or blocked by the user
+                    DBSession.query(DigestSubscription) \
+                        .filter(DigestSubscription.id == subscription_id) \
+                        .update(values, synchronize_session=False)
+
+    def _send(self, chat_id, message, retries=3):
+        """
+        :return: None once posted, otherwise the last botapi.Error
+        """
+        result = None
+        for _ in range(retries):
+            self.limiter.acquire()
+            result = self.weightloss_bot.bot.send_message(chat_id=chat_id, text=message, parse_mode="Markdown").wait()
+            if not isinstance(result, botapi.Error):
+                return None
+
+            retry_after = re.search(r'retry after (\d+)', result.description or '')
+            if result.error_code == 429 and retry_after:
+                self.limiter.back_off(int(retry_after.group(1)))
+            else:
+                break
+
+        self.logger.warning(f"Could not post digest to {chat_id}: {result.description}")
+        return result
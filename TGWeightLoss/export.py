@@ -0,0 +1,203 @@
+# Standard Library
+import argparse
+import configparser
+import csv
+import gzip
+import itertools
+import json
+import os.path
+
+from dateutil.parser import parse as dtparse
+from sqlalchemy import engine_from_config, select, union_all, literal
+
+from TGWeightLoss.models import *
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ['csv', 'parquet']
+
+COLUMNS = [
+    'contest_id', 'contest_title',
+    'participation_id', 'user_id', 'username', 'first_name', 'last_name',
+    'join_date', 'active', 'start_weight', 'goal_weight',
+    'update_id', 'update_date', 'progress', 'archived',
+]
+
+
+def _rows_query(contest_id):
+    """
+    One row per ProgressUpdate (hot or archived to the table) of the contest, participants without any update get a
+    single row with empty update columns
+    """
+    participation = UserParticipation.__table__
+    user = User.__table__
+    contest = Contest.__table__
+
+    def updates(table, archived):
+        return select([
+            table.c.participation_id,
+            table.c.id.label('update_id'),
+            table.c.update_date,
+            table.c.progress,
+            literal(archived).label('archived'),
+        ])
+
+    all_updates = union_all(
+        updates(ProgressUpdate.__table__, False),
+        updates(ArchivedProgressUpdate.__table__, True),
+    ).alias('all_updates')
+
+    return select([
+        contest.c.id.label('contest_id'),
+        contest.c.title.label('contest_title'),
+        participation.c.id.label('participation_id'),
+        user.c.id.label('user_id'),
+        user.c.username,
+        user.c.first_name,
+        user.c.last_name,
+        participation.c.join_date,
+        participation.c.active,
+        participation.c.start_weight,
+        participation.c.goal_weight,
+        all_updates.c.update_id,
+        all_updates.c.update_date,
+        all_updates.c.progress,
+        all_updates.c.archived,
+    ]).select_from(
+        contest.join(participation, participation.c.contest_id == contest.c.id)
+               .join(user, user.c.id == participation.c.user_id)
+               .outerjoin(all_updates, all_updates.c.participation_id == participation.c.id)
+    ).where(contest.c.id == contest_id) \
+     .order_by(participation.c.id, all_updates.c.update_date, all_updates.c.update_id)
+
+
+def _merge_archive_file(rows, path):
+    """
+    Expand the participant rows of a contest archived to a file with that file's updates. Both are ordered by
+    participation id, so the file is read alongside the query instead of loaded up front.
+    """
+    with gzip.open(path, 'rt') as archive_file:
+        groups = itertools.groupby((json.loads(line) for line in archive_file), key=lambda x: x['participation_id'])
+        participation_id, updates = next(groups, (None, None))
+
+        for row in rows:
+            while participation_id is not None and participation_id < row[2]:
+                participation_id, updates = next(groups, (None, None))
+
+            if participation_id != row[2]:
+                yield row
+                continue
+
+            for update in updates:
+                update_date = dtparse(update['update_date']) if update['update_date'] is not None else None
+                yield row[:11] + (update['id'], update_date, update['progress'], True)
+            participation_id, updates = next(groups, (None, None))
+
+
+def stream_rows(contest_id, batch_size=1000):
+    """
+    Yields lists of up to batch_size row tuples, read through a server-side cursor so memory use does not depend on
+    the size of the contest. Updates of a contest archived to a file are read from that file.
+    """
+    archive_path = DBSession.query(Contest.archive_path).filter(Contest.id == contest_id).scalar()
+    result = DBSession.connection().execution_options(stream_results=True).execute(_rows_query(contest_id))
+    try:
+        rows = (tuple(row) for batch in iter(lambda: result.fetchmany(batch_size), []) for row in batch)
+        if archive_path is not None:
+            rows = _merge_archive_file(rows, archive_path)
+
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            yield batch
+    finally:
+        result.close()
+
+
+def _write_csv(batches, fp):
+    writer = csv.writer(fp)
+    writer.writerow(COLUMNS)
+    count = 0
+    for batch in batches:
+        writer.writerows(batch)
+        count += len(batch)
+    return count
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ('contest_id', pyarrow.int64()),
+        ('contest_title', pyarrow.string()),
+        ('participation_id', pyarrow.int64()),
+        ('user_id', pyarrow.int64()),
+        ('username', pyarrow.string()),
+        ('first_name', pyarrow.string()),
+        ('last_name', pyarrow.string()),
+        ('join_date', pyarrow.timestamp('us')),
+        ('active', pyarrow.bool_()),
+        ('start_weight', pyarrow.int64()),
+        ('goal_weight', pyarrow.int64()),
+        ('update_id', pyarrow.int64()),
+        ('update_date', pyarrow.timestamp('us', tz='UTC')),
+        ('progress', pyarrow.int64()),
+        ('archived', pyarrow.bool_()),
+    ])
+
+
+def _write_parquet(batches, path):
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires pyarrow to be installed")
+
+    schema = _parquet_schema()
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            count += len(batch)
+    return count
+
+
+def export_contest(contest_id, path, fmt='csv', batch_size=1000):
+    """
+    Write every participant, goal and ProgressUpdate of a contest to path, one batch at a time.
+    :return: number of rows written
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt}, expected one of {', '.join(FORMATS)}")
+
+    batches = stream_rows(contest_id, batch_size=batch_size)
+    if fmt == 'parquet':
+        return _write_parquet(batches, path)
+
+    with open(path, 'w', newline='') as fp:
+        return _write_csv(batches, fp)
+
+
+if __name__ == '__main__':
+    # Run as script
+    parser = argparse.ArgumentParser(description="Export a contest's participants, goals and progress updates.")
+    parser.add_argument('contest_id', type=int)
+    parser.add_argument('output', help="File to write")
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    if not os.path.exists("config.ini"):
+        exit("Config file not found!")
+    configfile = configparser.ConfigParser()
+    configfile.read('config.ini')
+
+    engine = engine_from_config(configfile['WeightLossBot'], 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+
+    if not DBSession.query(Contest).filter(Contest.id == args.contest_id).first():
+        exit(f"Contest {args.contest_id} not found!")
+
+    print(f"Exported {export_contest(args.contest_id, args.output, args.format, args.batch_size)} rows to {args.output}")
@@ -0,0 +1,171 @@
+# Standard Library
+import itertools
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from twx import botapi
+
+from TGWeightLoss.models import *
+from TGWeightLoss import compliance as compliance_ledger
+
+
+class InlineAnswerCache:
+    """
+    Per-user precomputed inline query answers, so a keystroke is answered from memory instead of the database.
+
+    Entries are built on first use and dropped once a transaction that touched the user, one of their participations
+    or progress updates, or any contest commits. Touched users are collected at flush but only invalidated after the
+    commit, so a query answered in between cannot cache the data from before it. ttl bounds how stale an entry can get
+    through writes made outside this process.
+    """
+    PENDING = 'inline_cache_pending'  # session.info key of the user ids to invalidate when the session commits
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # user_id -> (expires_at, entry dict)
+        self.participation_users = {}  # participation_id -> user_id, for invalidating on ProgressUpdate writes
+        self.compliance = {}  # lowercase telegram username -> (date, {nutrient: status}), falls back to the compliance ledger
+        self.generation = 0  # Bumped on every invalidation so an entry built concurrently with a write is not stored
+
+        event.listen(DBSession, 'after_flush', self._after_flush)
+        event.listen(DBSession, 'after_commit', self._after_commit)
+        event.listen(DBSession, 'after_rollback', self._after_rollback)
+
+    def _after_flush(self, session, flush_context):
+        # session.info[PENDING] is None once a contest changed, which invalidates every entry
+        pending = session.info.setdefault(self.PENDING, set())
+        if pending is None:
+            return
+
+        dirty = [obj for obj in session.dirty if session.is_modified(obj)]
+        for obj in itertools.chain(session.new, dirty, session.deleted):
+            if isinstance(obj, Contest):
+                session.info[self.PENDING] = None
+                return
+            elif isinstance(obj, ProgressUpdate):
+                pending.add(self.participation_users.get(obj.participation_id))
+            elif isinstance(obj, UserParticipation):
+                pending.add(obj.user_id)
+            elif isinstance(obj, User):
+                pending.add(obj.id)
+        pending.discard(None)
+
+    def _after_commit(self, session):
+        if self.PENDING not in session.info:
+            return
+        pending = session.info.pop(self.PENDING)
+        if pending is None:
+            self.invalidate()
+        elif pending:
+            self.invalidate(pending)
+
+    def _after_rollback(self, session):
+        session.info.pop(self.PENDING, None)
+
+    def invalidate(self, user_ids=None):
+        with self.lock:
+            self.generation += 1
+            if user_ids is None:
+                self.entries.clear()
+                self.participation_users.clear()
+            else:
+                for user_id in user_ids:
+                    self.entries.pop(user_id, None)
+
+    def record_compliance(self, username, summary_date, statuses):
+        """
+        Keep the last evaluated compliance of a telegram username, as produced by get_mfp_summary
+        """
+        if not username:
+            return
+        key = username.lstrip('@').lower()
+        with self.lock:
+            self.compliance[key] = (summary_date, statuses)
+            self.generation += 1
+            stale = [user_id for user_id, (_, entry) in self.entries.items() if entry['username'] == key]
+            for user_id in stale:
+                del self.entries[user_id]
+
+    def get(self, user_id):
+        with self.lock:
+            cached = self.entries.get(user_id)
+            generation = self.generation
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        entry = self._build(user_id)
+        with self.lock:
+            if generation == self.generation:
+                self.entries[user_id] = (time.monotonic() + self.ttl, entry)
+        return entry
+
+    def _build(self, user_id):
+        user = DBSession.query(User).filter(User.id == user_id).first()
+        username = (user.username or '').lower() if user else ''
+
+        contests = []
+        participation_users = {}
+        for participation in UserParticipation.active_for_user(user_id, datetime.now()):
+            latest = participation.latest_update
+            participation_users[participation.id] = user_id
+            contests.append({
+                'participation_id': participation.id,
+                'title': participation.contest.title,
+                'latest_weight': latest.progress if latest else None,
+                'goal_weight': participation.goal_weight,
+            })
+
+        with self.lock:
+            self.participation_users.update(participation_users)
+            compliance = self.compliance.get(username)
+
+        if compliance is None and username:
+            latest = compliance_ledger.latest_day(username)
+            if latest is not None:
+                compliance = (latest[0], {k: '✅' if v else '❌' for k, v in latest[1].items()})
+
+        return {
+            'username': username,
+            'contests': contests,
+            'status_results': self._status_results(contests, compliance),
+        }
+
+    @staticmethod
+    def _status_results(contests, compliance):
+        if compliance is not None:
+            summary_date, statuses = compliance
+            compliance_text = f"{summary_date.strftime('%Y-%m-%d')}: " + " ".join(f"{k} {v}" for k, v in statuses.items())
+        else:
+            compliance_text = "No MFP summary yet"
+
+        results = []
+        for contest in contests:
+            weight = contest['latest_weight'] if contest['latest_weight'] is not None else "no weigh-in yet"
+            text = f"{contest['title']}\nLatest weight: {weight}"
+            if contest['goal_weight']:
+                text += f" (goal {contest['goal_weight']})"
+            text += f"\nCompliance {compliance_text}"
+
+            results.append(botapi.InlineQueryResultArticle(id=f"status-{contest['participation_id']}",
+                                                           title=f"Status: {contest['title']}",
+                                                           description=f"Latest: {weight} · {compliance_text}",
+                                                           input_message_content=botapi.InputTextMessageContent(message_text=text)))
+        return results
+
+    @staticmethod
+    def weigh_in_results(entry, weight, bot_username):
+        """
+        Only posts /weigh_in, which is recorded when the bot is in the chat it is sent to, so the result says so
+        instead of claiming the weigh-in is saved
+        """
+        if not entry['contests']:
+            return []
+
+        titles = ", ".join(contest['title'] for contest in entry['contests'])
+        return [botapi.InlineQueryResultArticle(id=f"weigh-{weight}",
+                                                title=f"Post /weigh_in {weight}",
+                                                description=f"Counts for {titles} only in a chat with @{bot_username}",
+                                                input_message_content=botapi.InputTextMessageContent(message_text=f"/weigh_in {weight}"))]
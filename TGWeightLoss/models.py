@@ -1,27 +1,66 @@
+import threading
+from contextlib import contextmanager
+
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import (
     Column,
     String,
     BigInteger,
     Integer,
+    SmallInteger,
+    Date,
     DateTime,
+    Time,
     ForeignKey,
     Boolean,
-    func
+    Text,
+    Index,
+    UniqueConstraint,
+    false,
+    func,
+    or_,
+    text
 )
 
 from sqlalchemy.orm import (
     scoped_session,
     sessionmaker,
     relationship,
+    backref,
     )
 
 
 DBSession = scoped_session(sessionmaker(expire_on_commit=False))
+_unit_of_work = threading.local()
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Transaction scope for handling one update: everything commits once at the end, rolls back on error, and the
+    thread's session is removed afterwards so the identity map does not grow across updates. Nested scopes (a
+    handler calling another handler) join the outermost one.
+    """
+    depth = getattr(_unit_of_work, 'depth', 0)
+    _unit_of_work.depth = depth + 1
+    try:
+        yield DBSession
+        if depth == 0:
+            DBSession.commit()
+    except BaseException:
+        if depth == 0:
+            DBSession.rollback()
+        raise
+    finally:
+        _unit_of_work.depth = depth
+        if depth == 0:
+            DBSession.remove()
 
 # Models
 Base = declarative_base()
 
+DEFAULT_TIMEZONE = "US/Pacific"
+
 
 class Chat(Base):
     __tablename__ = 'chat'
@@ -41,10 +80,32 @@ class Chat(Base):
         chat.title = src_chat.title
 
         DBSession.add(chat)
-        DBSession.commit()
 
         return chat
 
+class DigestSubscription(Base):
+    """
+    Daily MFP summary posted to a chat by TGWeightLoss.digest.DigestScheduler. timezone is also the chat's timezone
+    for parsing dates in commands.
+    """
+    __tablename__ = 'digest_subscription'
+
+    id = Column(Integer, primary_key=True)
+
+    chat_id = Column(BigInteger, ForeignKey('chat.id'), unique=True)
+    chat = relationship('Chat', backref=backref('digest', uselist=False))
+
+    post_time = Column(Time)  # Local time of day in timezone
+    timezone = Column(String, default=DEFAULT_TIMEZONE)
+    active = Column(Boolean, default=True)
+    last_posted = Column(Date)  # Local date of the last digest, so a chat is posted at most once a day
+
+    @staticmethod
+    def timezone_for(chat_id):
+        subscription = DBSession.query(DigestSubscription).filter(DigestSubscription.chat_id == chat_id).first()
+        return subscription.timezone if subscription and subscription.timezone else DEFAULT_TIMEZONE
+
+
 class User(Base):
     __tablename__ = 'user'
 
@@ -70,7 +131,6 @@ class User(Base):
         user.last_name = sender.last_name
 
         DBSession.add(user)
-        DBSession.commit()
 
         return user
 
@@ -82,11 +142,25 @@ class Contest(Base):
     title = Column(String)
     date_start = Column(DateTime)
     date_end = Column(DateTime)
+    archived = Column(Boolean, default=False, server_default=false())
+    archive_path = Column(String)  # Gzipped JSONL file holding the raw rows of an archived contest, NULL when they are in progress_update_archive
 
     @property
     def friendly_name(self):
         return f"{self.title}: {self.date_start} - {self.date_end}"
 
+    @staticmethod
+    def active_on(day):
+        return DBSession.query(Contest) \
+            .filter(func.date(Contest.date_start) <= day) \
+            .filter(func.date(Contest.date_end) >= day).all()
+
+    @staticmethod
+    def finished(now):
+        return DBSession.query(Contest) \
+            .filter(Contest.date_end < now) \
+            .filter(or_(Contest.archived == None, Contest.archived == False)).all()
+
 
 class UserParticipation(Base):
     __tablename__ = 'user_participation'
@@ -105,6 +179,21 @@ class UserParticipation(Base):
 
     active = Column(Boolean, default=True)
 
+    @staticmethod
+    def active_for_user(user_id, now):
+        return DBSession.query(UserParticipation) \
+            .join(Contest) \
+            .filter(UserParticipation.user_id == user_id) \
+            .filter(UserParticipation.active == True) \
+            .filter(Contest.date_start <= now) \
+            .filter(Contest.date_end >= now).all()
+
+    @property
+    def latest_update(self):
+        return DBSession.query(ProgressUpdate) \
+            .filter(ProgressUpdate.participation_id == self.id) \
+            .order_by(ProgressUpdate.update_date.desc()).first()
+
 
 class ProgressUpdate(Base):
     __tablename__ = 'progress_update'
@@ -114,5 +203,95 @@ class ProgressUpdate(Base):
     update_date = Column(DateTime(timezone=True), default=func.now())
     progress = Column(Integer)  # Weight Check-in
 
-    participation_id = Column(Integer, ForeignKey('user_participation.id'))
+    participation_id = Column(Integer, ForeignKey('user_participation.id'), index=True)
     participation = relationship('UserParticipation', backref='updates')
+
+
+class ArchivedProgressUpdate(Base):
+    """
+    Raw ProgressUpdate rows of finished contests, moved out of the hot table by TGWeightLoss.archive
+    """
+    __tablename__ = 'progress_update_archive'
+
+    id = Column(Integer, primary_key=True)  # Keeps the original ProgressUpdate.id so rows can be restored as-is
+
+    update_date = Column(DateTime(timezone=True))
+    progress = Column(Integer)
+
+    participation_id = Column(Integer, ForeignKey('user_participation.id'), index=True)
+
+
+class ParticipationSummary(Base):
+    """
+    Compacted weigh-in history of a participation in a finished contest
+    """
+    __tablename__ = 'participation_summary'
+
+    id = Column(Integer, primary_key=True)
+
+    first_update_date = Column(DateTime(timezone=True))
+    last_update_date = Column(DateTime(timezone=True))
+    start_progress = Column(Integer)
+    end_progress = Column(Integer)
+    min_progress = Column(Integer)
+    update_count = Column(Integer, default=0)
+    weekly_series = Column(Text)  # JSON list of [week_index, last weight of that week]
+
+    participation_id = Column(Integer, ForeignKey('user_participation.id'), unique=True)
+    participation = relationship('UserParticipation', backref=backref('summary', uselist=False))
+
+
+class ComplianceRecord(Base):
+    """
+    One evaluated day of one nutrient goal for one MFP summary participant, as computed by get_mfp_summary. Kept once
+    per ComplianceStreak scope (contest_id NULL for all-time), so each counter knows exactly which days it counted.
+    """
+    __tablename__ = 'compliance_record'
+    __table_args__ = (
+        UniqueConstraint('participant', 'day', 'nutrient', 'contest_id', name='uq_compliance_record_participant_day_nutrient_contest'),
+        Index('uq_compliance_record_participant_day_nutrient_all_time', 'participant', 'day', 'nutrient', unique=True,
+              postgresql_where=text('contest_id IS NULL'), sqlite_where=text('contest_id IS NULL')),
+        Index('ix_compliance_record_participant_nutrient_day', 'participant', 'nutrient', 'day'),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    participant = Column(String(64), nullable=False)  # Lowercase telegram username from the goals sheet
+    day = Column(Date, nullable=False)
+    nutrient = Column(SmallInteger, nullable=False)  # Index into TGWeightLoss.compliance.NUTRIENTS
+    contest_id = Column(Integer, ForeignKey('contest.id'), nullable=True)
+    compliant = Column(Boolean, nullable=False)
+
+
+class ComplianceStreak(Base):
+    """
+    Running compliance counters of a participant for one nutrient (or all of them), kept up to date as
+    ComplianceRecords are written. contest_id is NULL for the all-time counters.
+    """
+    __tablename__ = 'compliance_streak'
+    __table_args__ = (
+        UniqueConstraint('participant', 'nutrient', 'contest_id', name='uq_compliance_streak_participant_nutrient_contest'),
+        # NULLs never collide in a unique constraint, so the all-time counters need their own partial index
+        Index('uq_compliance_streak_participant_nutrient_all_time', 'participant', 'nutrient', unique=True,
+              postgresql_where=text('contest_id IS NULL'), sqlite_where=text('contest_id IS NULL')),
+        Index('ix_compliance_streak_contest', 'contest_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    participant = Column(String(64), nullable=False)
+    name = Column(String)
+    nutrient = Column(SmallInteger, nullable=False)
+    contest_id = Column(Integer, ForeignKey('contest.id'), nullable=True)
+
+    last_day = Column(Date)
+    current_streak = Column(Integer, default=0)
+    streak_before_last_day = Column(Integer, default=0)  # These two let a re-evaluation of last_day be applied exactly
+    longest_before_last_day = Column(Integer, default=0)
+    longest_streak = Column(Integer, default=0)
+    days_evaluated = Column(Integer, default=0)
+    days_compliant = Column(Integer, default=0)
+
+    @property
+    def compliance_pct(self):
+        return 100.0 * self.days_compliant / self.days_evaluated if self.days_evaluated else 0.0
@@ -0,0 +1,143 @@
+# Standard Library
+import hashlib
+import json
+import re
+import threading
+import time
+
+# Keys whose value is a Telegram User/Chat object, these get their id pseudonymized and names replaced
+IDENTITY_KEYS = {'from', 'chat', 'user', 'forward_from', 'forward_from_chat', 'left_chat_member', 'new_chat_members'}
+NAME_FIELDS = {'first_name', 'last_name', 'username', 'title', 'language_code'}
+DROPPED_FIELDS = {'contact', 'location', 'venue', 'photo', 'document', 'audio', 'voice', 'video', 'video_note',
+                  'sticker', 'new_chat_photo', 'phone_number', 'author_signature', 'forward_signature', 'url'}
+# Keys holding free text typed by people, reduced by scrub_text
+TEXT_FIELDS = {'text', 'caption', 'query'}
+
+# Weights, dates and times (185, 185.4, 2018-01-31, 7:30) are kept in arguments so weigh-ins and add_contest replies replay
+_KEPT_ARGUMENT = re.compile(r'\d{1,4}(?:[.,]\d{1,2})?|\d{4}-\d{2}-\d{2}|\d{1,2}:\d{2}')
+_TOKEN = re.compile(r'\S+')
+
+
+def scrub_text(text, keep_arguments=False):
+    """
+    Keep a leading /command, and with keep_arguments weight, date and time shaped tokens; replace every other word
+    with x's of the same length so message entity offsets stay valid
+    """
+    command_start = len(text) - len(text.lstrip())
+
+    def replace(match):
+        token = match.group()
+        if match.start() == command_start and token.startswith('/'):
+            return token
+        if keep_arguments and _KEPT_ARGUMENT.fullmatch(token):
+            return token
+        return 'x' * len(token)
+
+    return _TOKEN.sub(replace, text)
+
+
+def _addresses_bot(data, key):
+    """
+    Whether the text under key was typed for the bot to parse: a command, a reply to one of the bot's messages or an
+    inline query
+    """
+    if key == 'query':
+        return True
+    if data[key].lstrip().startswith('/'):
+        return True
+    reply_to = data.get('reply_to_message')
+    return isinstance(reply_to, dict) and bool(reply_to.get('from', {}).get('is_bot'))
+
+
+def to_dict(obj):
+    """
+    Turn a parsed twx.botapi object (nested namedtuples) back into the JSON shape Telegram sent, so that
+    botapi.Update.from_dict() can rebuild it on replay
+    """
+    if hasattr(obj, '_asdict'):
+        result = {}
+        for key, value in obj._asdict().items():
+            if value is None:
+                continue
+            result['from' if key == 'sender' else key] = to_dict(value)
+        return result
+    elif isinstance(obj, (list, tuple)):
+        return [to_dict(x) for x in obj]
+    return obj
+
+
+class UpdateRecorder:
+    """
+    Appends every update returned by bot.get_updates to a JSONL log, one {"t": unix time, "update": {...}} per line,
+    with ids pseudonymized, names/contact details stripped and message text reduced by scrub_text. Replay the log with
+    TGWeightLoss.replay.
+
+    salt has to stay the same across restarts, otherwise a user gets a new pseudonym and reply chains in the log break.
+    """
+    def __init__(self, path, salt):
+        self.path = path
+        self.salt = salt.encode() if isinstance(salt, str) else salt
+        self.lock = threading.Lock()
+
+    def install(self, bot):
+        get_updates = bot.get_updates
+
+        def recording_get_updates(*args, **kwargs):
+            on_success = kwargs.pop('on_success', None)
+
+            def record(updates):
+                self.write(updates)
+                if on_success is not None:
+                    on_success(updates)
+
+            return get_updates(*args, on_success=record, **kwargs)
+
+        bot.get_updates = recording_get_updates
+        return bot
+
+    def write(self, updates):
+        if not updates:
+            return
+        now = time.time()
+        lines = [json.dumps({'t': now, 'update': self.scrub(to_dict(update))}) + "\n" for update in updates]
+        with self.lock, open(self.path, 'a') as log:
+            log.writelines(lines)
+
+    def _pseudonym(self, value):
+        digest = hashlib.sha256(self.salt + str(abs(value)).encode()).hexdigest()
+        pseudonym = int(digest[:12], 16)
+        return -pseudonym if value < 0 else pseudonym  # Keep group chat ids negative
+
+    def _scrub_identity(self, identity):
+        if isinstance(identity, list):
+            return [self._scrub_identity(x) for x in identity]
+
+        scrubbed = {}
+        for key, value in identity.items():
+            if key == 'id':
+                scrubbed['id'] = self._pseudonym(value)
+            elif key in NAME_FIELDS:
+                scrubbed[key] = f"{key}_{self._pseudonym(identity.get('id', 0)) % 100000}"
+            elif key not in DROPPED_FIELDS:
+                scrubbed[key] = value
+        return scrubbed
+
+    def scrub(self, data):
+        if isinstance(data, list):
+            return [self.scrub(x) for x in data]
+        if not isinstance(data, dict):
+            return data
+
+        scrubbed = {}
+        for key, value in data.items():
+            if key in DROPPED_FIELDS:
+                continue
+            elif key in IDENTITY_KEYS:
+                scrubbed[key] = self._scrub_identity(value)
+            elif key == 'user_id':
+                scrubbed[key] = self._pseudonym(value)
+            elif key in TEXT_FIELDS and isinstance(value, str):
+                scrubbed[key] = scrub_text(value, keep_arguments=_addresses_bot(data, key))
+            else:
+                scrubbed[key] = self.scrub(value)
+        return scrubbed
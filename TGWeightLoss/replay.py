@@ -0,0 +1,375 @@
+# Standard Library
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, event
+from twx import botapi
+
+from TGWeightLoss.models import *
+from TGWeightLoss.WeightLoss import WeightLossBot
+from TGWeightLoss.bench_diary import synthetic_diary_html
+from TGWeightLoss.recorder import scrub_text
+
+
+def read_log(path):
+    with open(path) as log:
+        for line in log:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+# region stubs
+class StubRequest:
+    """
+    Stands in for a TelegramBotRPCRequest that already finished
+    """
+    def __init__(self, result):
+        self.result = result
+
+    def run(self):
+        return self
+
+    def join(self, timeout=None):
+        return self
+
+    def wait(self, timeout=None):
+        return self.result
+
+
+class StubTelegramBot:
+    """
+    Accepts every Bot API call without touching the network. Calls that return a Message get a fresh message_id
+    so reply watches can be registered against them. api_latency simulates the round trip to Telegram.
+    """
+    def __init__(self, api_latency=0.0):
+        self.api_latency = api_latency
+        self.username = "ReplayBot"
+        self.calls = defaultdict(int)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _call(self, name, result=True):
+        with self._lock:
+            self.calls[name] += 1
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        return StubRequest(result)
+
+    def _message(self, chat_id, text):
+        return botapi.Message.from_result({
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group' if str(chat_id).startswith('-') else 'private'},
+            'from': {'id': 0, 'is_bot': True, 'first_name': self.username, 'username': self.username},
+            'text': text,
+        })
+
+    def update_bot_info(self):
+        return StubRequest(None)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._call('send_message', self._message(chat_id, text))
+
+    def edit_message_text(self, text, chat_id=None, **kwargs):
+        return self._call('edit_message_text', self._message(chat_id, text))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(name)
+
+
+class _StubResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+
+class StubMFPClient:
+    """
+    Serves a deterministic fake diary page per username/date, so replays run the real diary parser
+    """
+    def __init__(self, latency=0.0, entries_per_meal=8):
+        self.latency = latency
+        self.entries_per_meal = entries_per_meal
+
+    def _login(self):
+        pass
+
+    def _get_full_name(self, raw_name):
+        name = raw_name.lower().strip()
+        return 'carbohydrates' if name == 'carbs' else name
+
+    def _get_url_for_date(self, summary_date, username):
+        return f"{username}/{summary_date.strftime('%Y-%m-%d')}"
+
+    def _get_request_for_url(self, url, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return _StubResponse(synthetic_diary_html(url, self.entries_per_meal))
+
+
+class StubWorksheet:
+    """
+    Mimics the layout of the "Goals" sheet read by WeightLossBot._get_participants
+    """
+    def __init__(self, participants=6):
+        self.rows = [[''] * 16]
+        for i in range(participants):
+            row = [f"Participant {i}"] + [''] * 15
+            row[7:16] = ['1800', '30', 'Max', '120', 'Min', '100', 'Min', f"participant{i}", f"https://www.myfitnesspal.com/profile/participant{i}"]
+            self.rows.append(row)
+
+    def worksheet(self, name):
+        return self
+
+    def get_all_values(self):
+        return self.rows
+# endregion
+
+
+class ReplayUpdateLoop:
+    """
+    In-process stand-in for UpdateLoop: keeps the same registration API WeightLossBot uses and dispatches one
+    update at a time. Permissions are not checked. Bot messages get new ids on replay, so reply watches and inline
+    replies fall back to matching the chat and text of the message being replied to, compared the way the recorder
+    scrubbed it.
+    """
+    def __init__(self, bot, handler):
+        self.bot = bot
+        self.handler = handler
+        self.commands = {}
+        self.lock = threading.Lock()
+        self.reply_watches = {}
+        self.inline_replies = {}
+
+    def register_command(self, name, function, permission=None):
+        self.commands[name] = function
+
+    def _watch(self, watches, message, function):
+        with self.lock:
+            watches[(message.chat.id, message.message_id)] = function
+            watches.setdefault((message.chat.id, scrub_text(message.text or '')), deque()).append(function)
+
+    def _pop_watch(self, watches, message):
+        with self.lock:
+            function = watches.pop((message.chat.id, message.message_id), None)
+            pending = watches.get((message.chat.id, scrub_text(message.text or '')))
+            if function is None:
+                if pending:
+                    function = pending.popleft()
+            elif pending and function in pending:
+                pending.remove(function)
+            return function
+
+    def register_reply_watch(self, message, function):
+        self._watch(self.reply_watches, message, function)
+
+    def register_inline_reply(self, message, srcmsg, function, permission=None):
+        self._watch(self.inline_replies, message, function)
+
+    @staticmethod
+    def _label(function):
+        return getattr(getattr(function, 'func', function), '__name__', repr(function))
+
+    def dispatch(self, update):
+        """
+        :return: label of the handler that ran, or None if nothing handled the update
+        """
+        msg = update.message
+        if msg is not None and msg.reply_to_message is not None:
+            function = self._pop_watch(self.reply_watches, msg.reply_to_message)
+            if function is not None:
+                function(msg)
+                return f"reply:{self._label(function)}"
+
+        if msg is not None and msg.text and msg.text.startswith('/'):
+            command, _, arguments = msg.text[1:].partition(' ')
+            function = self.commands.get(command.split('@')[0])
+            if function is not None:
+                function(msg, arguments.strip())
+                return f"/{command.split('@')[0]}"
+
+        if update.callback_query is not None and update.callback_query.message is not None:
+            function = self._pop_watch(self.inline_replies, update.callback_query.message)
+            if function is not None:
+                function(update.callback_query, update.callback_query.data)
+                return f"callback:{self._label(function)}"
+
+        if update.inline_query is not None and hasattr(self.handler, 'inline_query'):
+            self.handler.inline_query(update.inline_query)
+            return "inline_query"
+
+        return None
+
+
+class DBContention:
+    """
+    Times every statement run on the engine and counts lock errors, to show how hard replayed traffic leans on the DB
+    """
+    def __init__(self, engine):
+        self.lock = threading.Lock()
+        self.statement_times = []
+        self.commits = 0
+        self.lock_errors = 0
+
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        event.listen(engine, 'commit', self._commit)
+        event.listen(engine, 'handle_error', self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('replay_query_start', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['replay_query_start'].pop()
+        with self.lock:
+            self.statement_times.append(elapsed)
+
+    def _commit(self, conn):
+        with self.lock:
+            self.commits += 1
+
+    def _error(self, context):
+        if 'locked' in str(context.original_exception).lower() or 'deadlock' in str(context.original_exception).lower():
+            with self.lock:
+                self.lock_errors += 1
+
+
+class ReplayDriver:
+    """
+    Feeds a recorded update log to a WeightLossBot built on ReplayUpdateLoop. Updates of one chat are handled in
+    order on the same worker (so reply chains line up), different chats run in parallel like UpdateLoop's threads.
+    """
+    def __init__(self, weightloss_bot, workers=4):
+        self.weightloss_bot = weightloss_bot
+        self.workers = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.unhandled = 0
+
+    @staticmethod
+    def _chat_id(update):
+        for msg in (update.message, update.edited_message, update.callback_query and update.callback_query.message):
+            if msg is not None:
+                return msg.chat.id
+        if update.inline_query is not None:
+            return update.inline_query.sender.id
+        return 0
+
+    def _handle(self, update):
+        start = time.perf_counter()
+        try:
+            label = self.weightloss_bot.update_loop.dispatch(update)
+        except Exception:
+            DBSession.rollback()
+            label = 'error'
+            with self.lock:
+                self.errors[self._label_of_failed(update)] += 1
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            if label is None:
+                self.unhandled += 1
+            elif label != 'error':
+                self.latencies[label].append(elapsed)
+
+    @staticmethod
+    def _label_of_failed(update):
+        if update.message is not None and update.message.text and update.message.text.startswith('/'):
+            return update.message.text.split()[0]
+        return 'other'
+
+    def run(self, records, realtime=False):
+        """
+        :param realtime: sleep between updates to reproduce the recorded timing, otherwise replay as fast as possible
+        :return: wall clock seconds the replay took
+        """
+        start = time.perf_counter()
+        first_t = None
+
+        for record in records:
+            if realtime:
+                first_t = record['t'] if first_t is None else first_t
+                delay = (record['t'] - first_t) - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            update = botapi.Update.from_dict(record['update'])
+            worker = self.workers[hash(self._chat_id(update)) % len(self.workers)]
+            worker.submit(self._handle, update)
+
+        for worker in self.workers:
+            worker.shutdown(wait=True)
+
+        return time.perf_counter() - start
+
+    def report(self, wall_time, contention=None):
+        handled = sum(len(x) for x in self.latencies.values())
+        lines = [f"Replayed {handled + self.unhandled + sum(self.errors.values())} updates in {wall_time:.2f}s "
+                 f"({handled / wall_time if wall_time else 0:.1f} handled/s, {self.unhandled} unhandled, {sum(self.errors.values())} errors)",
+                 "",
+                 f"{'handler':<45}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+
+        for label, values in sorted(self.latencies.items(), key=lambda x: -len(x[1])):
+            lines.append(f"{label:<45}{len(values):>7}"
+                         f"{_percentile(values, 50) * 1000:>10.1f}{_percentile(values, 95) * 1000:>10.1f}"
+                         f"{_percentile(values, 99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+
+        for label, count in self.errors.items():
+            lines.append(f"{label}: {count} errors")
+
+        if contention is not None:
+            times = contention.statement_times
+            lines += ["",
+                      f"DB: {len(times)} statements, {contention.commits} commits, {sum(times):.2f}s total, "
+                      f"p95 {_percentile(times, 95) * 1000:.1f}ms, max {max(times, default=0) * 1000:.1f}ms, "
+                      f"{contention.lock_errors} lock errors"]
+
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # Run as script
+    parser = argparse.ArgumentParser(description="Replay a recorded update log against a WeightLossBot wired to stubs.")
+    parser.add_argument('log', help="JSONL log written by record_updates")
+    parser.add_argument('--db', default="sqlite:///data/replay.db", help="Database to replay against, never point this at production")
+    parser.add_argument('--realtime', action='store_true', help="Keep the recorded gaps between updates")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Seconds each stubbed Telegram call takes")
+    parser.add_argument('--mfp-latency', type=float, default=0.0, help="Seconds each stubbed MFP diary fetch takes")
+    args = parser.parse_args()
+
+    engine = create_engine(args.db)
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+    contention = DBContention(engine)
+
+    weightloss_bot = WeightLossBot({'WeightLossBot': {}},
+                                   bot=StubTelegramBot(api_latency=args.api_latency),
+                                   mfp=StubMFPClient(latency=args.mfp_latency),
+                                   worksheet=StubWorksheet(),
+                                   update_loop_cls=ReplayUpdateLoop)
+
+    driver = ReplayDriver(weightloss_bot, workers=args.workers)
+    wall_time = driver.run(read_log(args.log), realtime=args.realtime)
+    print(driver.report(wall_time, contention))
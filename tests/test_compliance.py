@@ -0,0 +1,144 @@
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+import sqlalchemy.exc
+from sqlalchemy import create_engine
+
+from TGWeightLoss.models import *
+from TGWeightLoss import compliance
+
+DAY = date(2024, 3, 1)
+
+
+@pytest.fixture(autouse=True)
+def db():
+    engine = create_engine('sqlite://')
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+    yield
+    DBSession.remove()
+
+
+def outcomes(compliant):
+    return {nutrient: compliant for nutrient in compliance.NUTRIENTS if nutrient != 'All'}
+
+
+def streak(contest_id=None, nutrient='Cals'):
+    return compliance.participant_streaks('al', contest_id)[nutrient]
+
+
+def record(day, compliant, contest_ids=()):
+    compliance.record_day('al', 'Al', day, outcomes(compliant), contest_ids)
+    DBSession.flush()
+
+
+def counters(row):
+    return row.current_streak, row.longest_streak, row.days_evaluated, row.days_compliant
+
+
+def test_consecutive_days_build_a_streak():
+    for i in range(3):
+        record(DAY + timedelta(i), True)
+    assert counters(streak()) == (3, 3, 3, 3)
+
+
+def test_gap_resets_current_streak_but_keeps_longest():
+    record(DAY, True)
+    record(DAY + timedelta(1), True)
+    record(DAY + timedelta(3), True)
+    assert counters(streak()) == (1, 2, 3, 3)
+
+
+def test_reevaluating_last_day_as_non_compliant_undoes_it():
+    for i in range(3):
+        record(DAY + timedelta(i), True)
+    record(DAY + timedelta(2), False)
+    assert counters(streak()) == (0, 2, 3, 2)
+
+    record(DAY + timedelta(2), True)
+    assert counters(streak()) == (3, 3, 3, 3)
+
+
+def test_reevaluating_last_day_keeps_an_older_longest_streak():
+    for i in range(4):
+        record(DAY + timedelta(i), True)
+    record(DAY + timedelta(5), True)
+    record(DAY + timedelta(5), False)
+    assert counters(streak()) == (0, 4, 5, 4)
+
+
+def test_backfilling_an_older_day_only_moves_compliance():
+    record(DAY + timedelta(1), True)
+    record(DAY, False)
+    assert counters(streak()) == (1, 1, 2, 1)
+    assert streak().compliance_pct == 50.0
+
+
+def test_new_contest_counter_counts_a_rerun_day_as_first_evaluation():
+    contest = Contest(title='Spring', date_start=datetime(2024, 3, 1), date_end=datetime(2024, 4, 1))
+    DBSession.add(contest)
+    DBSession.flush()
+
+    record(DAY, True)
+    record(DAY, True, [contest.id])
+    assert counters(streak()) == (1, 1, 1, 1)
+    assert counters(streak(contest.id)) == (1, 1, 1, 1)
+
+    record(DAY + timedelta(1), False)
+    record(DAY + timedelta(1), True, [contest.id])
+    assert counters(streak(contest.id)) == (2, 2, 2, 2)
+    assert counters(streak()) == (2, 2, 2, 2)
+
+
+def test_counters_match_a_full_recompute():
+    rng = random.Random(7)
+    day = DAY
+    history = []
+    for _ in range(200):
+        if history and rng.random() < 0.3:
+            compliant = rng.random() < 0.7
+            history[-1] = (history[-1][0], compliant)  # Re-run the last day with a new outcome
+        else:
+            day += timedelta(rng.choice([1, 1, 1, 2]))
+            compliant = rng.random() < 0.7
+            history.append((day, compliant))
+        record(day, compliant)
+
+    current = longest = 0
+    previous_day = None
+    for day, compliant in history:
+        consecutive = previous_day is not None and day == previous_day + timedelta(1)
+        current = (current if consecutive else 0) + 1 if compliant else 0
+        longest = max(longest, current)
+        previous_day = day
+
+    assert counters(streak()) == (current, longest, len(history), sum(c for _, c in history))
+
+
+def test_duplicate_counters_are_rejected():
+    for contest_id in [None, 1]:
+        DBSession.add(ComplianceStreak(participant='al', nutrient=0, contest_id=contest_id))
+        DBSession.add(ComplianceStreak(participant='al', nutrient=0, contest_id=contest_id))
+        with pytest.raises(sqlalchemy.exc.IntegrityError):
+            DBSession.flush()
+        DBSession.rollback()
+
+
+def test_contest_counter_counts_rerun_days_recorded_before_the_contest_existed():
+    for i in range(5):
+        record(DAY + timedelta(i), True)
+    contest = Contest(title='Spring', date_start=datetime(2024, 3, 1), date_end=datetime(2024, 4, 1))
+    DBSession.add(contest)
+    DBSession.flush()
+
+    record(DAY + timedelta(5), True, [contest.id])
+    for i in range(2, 5):
+        record(DAY + timedelta(i), False, [contest.id])
+    assert counters(streak(contest.id)) == (1, 1, 4, 1)
+    assert streak(contest.id).compliance_pct == 25.0
+    assert counters(streak()) == (6, 6, 6, 3)  # Re-running older days only moves compliance
+
+    record(DAY, True, [contest.id])  # Same outcome as before, but new to the contest counter
+    assert counters(streak(contest.id)) == (1, 1, 5, 2)
+    assert counters(streak()) == (6, 6, 6, 3)  # Re-running older days only moves compliance